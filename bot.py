@@ -1,15 +1,24 @@
 import os
+import re
 import shutil
 import subprocess
 import asyncio
+import atexit
 import logging
 import hashlib
-import json
+import functools
+import fnmatch
+import time
+import orjson
+import aiofiles
+import aiofiles.os
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from pathlib import Path
-from collections import defaultdict
+from collections import Counter, OrderedDict
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.types import (
     Message,
@@ -19,8 +28,14 @@ from aiogram.types import (
     CallbackQuery
 )
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from dotenv import load_dotenv
 
+try:
+    import uvloop  # Более быстрый цикл событий на базе libuv
+except ImportError:
+    uvloop = None
+
 # Константы
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB лимит Telegram
 CACHE_DIR = Path("video_cache")
@@ -28,7 +43,61 @@ LOG_DIR = Path("logs")  # Директория для логов
 CACHE_EXPIRE_DAYS = 3  # Хранение кеша 3 дня
 LOG_EXPIRE_DAYS = 3  # Хранение логов 3 дня
 MAX_CACHE_SIZE_GB = 1  # Максимальный размер кеша
-STATS_FILE = Path("bot_stats.json")
+DOWNLOAD_TIMEOUT = 120  # Таймаут загрузки yt-dlp в секундах
+UPLOAD_CHUNK_SIZE = 256 * 1024  # Размер блока чтения файла при отправке в Telegram
+TELEGRAM_TIMEOUT = 180  # Таймаут загрузки видео в Telegram (сек); остальные запросы - с таймаутом сессии
+STATS_FILE = Path("bot_stats.json")  # Снимок статистики
+STATS_JOURNAL = STATS_FILE.with_suffix(".jsonl")  # Журнал событий статистики
+# Событие статистики -> счетчик в bot_stats
+STATS_COUNTERS = {"request": "total_requests"}
+# Итог запроса (поле result события) -> счетчик в bot_stats
+STATS_RESULTS = {
+    "success": "successful_downloads",
+    "failure": "failed_downloads"
+}
+STATS_FLUSH_DELAY = 2.0  # Задержка перед записью статистики (сек)
+JANITOR_INTERVAL = 300  # Период фоновой очистки логов и кеша (сек)
+# Имя сработавшей группы определяет платформу
+URL_RE = re.compile(
+    r'https?://(?:(?P<tiktok>vm\.tiktok\.com|www\.tiktok\.com)|'
+    r'(?P<instagram>www\.instagram\.com/reel)|'
+    r'(?P<youtube>youtu\.be|youtube\.com/shorts))\S+'
+)
+# Подстроки, без которых URL_RE не может совпасть (быстрый отсев сообщений)
+URL_HINTS = ("tiktok.com", "instagram.com/reel", "youtu.be", "youtube.com/shorts")
+# Отображаемые названия платформ (имена групп URL_RE)
+PLATFORM_NAMES = {
+    "tiktok": "TikTok",
+    "instagram": "Instagram",
+    "youtube": "YouTube",
+    "other": "Інші"
+}
+
+class FileTooLargeError(Exception):
+    """Видео превышает лимит Telegram на размер файла"""
+
+class TelegramSession(AiohttpSession):
+    """Сессия aiogram с теплым пулом соединений и кешем DNS для api.telegram.org"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # AiohttpSession (aiogram 3.3.0) не принимает настройки TCPConnector в конструкторе
+        # и передает ему приватный словарь _connector_init: при обновлении aiogram
+        # проверить, что атрибут по-прежнему используется
+        self._connector_init.update(
+            limit=64,
+            limit_per_host=16,
+            ttl_dns_cache=300,
+            keepalive_timeout=60
+        )
+
+@dataclass(slots=True)
+class VideoRequest:
+    """Ссылка на видео, разобранная один раз на входе в обработчик"""
+    url: str
+    platform: str
+    url_hash: str
+    cached_file: Path
 
 # Создаем необходимые директории
 CACHE_DIR.mkdir(exist_ok=True)
@@ -40,30 +109,44 @@ bot_stats = {
     "successful_downloads": 0,
     "failed_downloads": 0,
     "cache_hits": 0,
-    "platform_stats": defaultdict(int),
-    "user_stats": defaultdict(int),
+    "platform_stats": Counter(),
+    "user_stats": Counter(),  # ключи - user_id (int)
+    "journal_seq": 0,  # Номер последнего учтенного события журнала
     "last_activity": datetime.now().isoformat()
 }
 load_dotenv()
+session = TelegramSession(json_loads=orjson.loads)
 bot = Bot(
     token=os.getenv("BOT_TOKEN"),
+    session=session,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 dp = Dispatcher()
+# Ограничение одновременных загрузок yt-dlp
+DOWNLOAD_SEM = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "4")))
+# Текущие загрузки по хешу URL (для объединения одинаковых запросов)
+INFLIGHT: dict[str, asyncio.Future] = {}
+# Флаг изменения статистики для фоновой записи
+_stats_dirty = asyncio.Event()
+# События статистики, еще не записанные в журнал
+_stats_pending: list[dict] = []
+_stats_lock = asyncio.Lock()
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background_tasks: set[asyncio.Task] = set()
+# LRU-индекс кеша: имя файла -> размер, от давно использованных к недавним
+cache_index: OrderedDict[str, int] = OrderedDict()
+cache_size = 0  # Суммарный размер файлов в cache_index
+# Сканирование CACHE_DIR, добавление и вытеснение файлов не должны пересекаться
+cache_lock = asyncio.Lock()
+# file_id видео, уже загруженных в Telegram: имя файла кеша -> file_id
+video_file_ids: dict[str, str] = {}
+DOWNLOAD_MORE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📥 Скачати ще", callback_data="download_more")]
+])
 # Проверка наличия токена
 if not os.getenv("BOT_TOKEN"):
     logging.critical("BOT_TOKEN не установлен")
     exit(1)
-# Загрузка статистики из файла
-if STATS_FILE.exists():
-    try:
-        with open(STATS_FILE, "r") as f:
-            loaded_stats = json.load(f)
-            bot_stats.update(loaded_stats)
-            bot_stats["platform_stats"] = defaultdict(int, loaded_stats.get("platform_stats", {}))
-            bot_stats["user_stats"] = defaultdict(int, loaded_stats.get("user_stats", {}))
-    except Exception as e:
-        logging.error(f"Ошибка загрузки статистики: {str(e)}")
 
 
 # Настройка логирования
@@ -84,20 +167,149 @@ def setup_logging():
 
 logger = setup_logging()
 
-def save_stats():
-    """Сохраняет статистику в файл"""
+def apply_stat_event(event: dict):
+    """Применяет событие статистики к bot_stats"""
+    counter = STATS_COUNTERS.get(event["event"])
+    if counter:
+        bot_stats[counter] += 1
+    # Итог запроса записывается в том же событии, что и сам запрос
+    result = STATS_RESULTS.get(event.get("result"))
+    if result:
+        bot_stats[result] += 1
+    if event.get("cache_hit"):
+        bot_stats["cache_hits"] += 1
+    if "user" in event:
+        bot_stats["user_stats"][event["user"]] += 1
+    if "platform" in event:
+        bot_stats["platform_stats"][event["platform"]] += 1
+
+def record_stat(event: str, **fields):
+    """Учитывает событие в статистике и ставит его в очередь на запись в журнал"""
+    bot_stats["journal_seq"] += 1
+    entry = {"event": event, "seq": bot_stats["journal_seq"], "ts": int(time.time()), **fields}
+    apply_stat_event(entry)
+    _stats_pending.append(entry)
+    _stats_dirty.set()
+
+def load_stats():
+    """Загружает снимок статистики и применяет к нему события из журнала"""
     try:
-        stats_to_save = bot_stats.copy()
-        stats_to_save["platform_stats"] = dict(bot_stats["platform_stats"])
-        stats_to_save["user_stats"] = dict(bot_stats["user_stats"])
-        
-        with open(STATS_FILE, "w") as f:
-            json.dump(stats_to_save, f, indent=2)
+        with open(STATS_FILE, "rb") as f:
+            loaded_stats = orjson.loads(f.read())
+        bot_stats.update(loaded_stats)
+        bot_stats["platform_stats"] = Counter(loaded_stats.get("platform_stats", {}))
+        # JSON хранит ключи строками, в памяти user_id - int
+        bot_stats["user_stats"] = Counter(
+            {int(k): v for k, v in loaded_stats.get("user_stats", {}).items()}
+        )
+    except FileNotFoundError:
+        pass
     except Exception as e:
-        logger.error(f"Ошибка сохранения статистики: {str(e)}")
+        logger.error(f"Ошибка загрузки статистики: {str(e)}")
+    # События с номером не больше этого уже включены в снимок
+    snapshot_seq = bot_stats["journal_seq"]
+    try:
+        last_ts = None
+        with open(STATS_JOURNAL, "rb") as f:
+            for line in f:
+                try:
+                    event = orjson.loads(line)
+                    seq, last_ts = event["seq"], event["ts"]
+                except (orjson.JSONDecodeError, KeyError, TypeError):
+                    # Например, недописанная строка после аварийной остановки
+                    logger.warning("Пропущена поврежденная запись журнала статистики")
+                    continue
+                if seq <= snapshot_seq:
+                    continue
+                apply_stat_event(event)
+                bot_stats["journal_seq"] = max(bot_stats["journal_seq"], seq)
+        if last_ts:
+            bot_stats["last_activity"] = datetime.fromtimestamp(last_ts).isoformat()
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Ошибка чтения журнала статистики: {str(e)}")
+
+async def save_stats():
+    """Дописывает накопленные события статистики в журнал"""
+    global _stats_pending
+    # Блокировка: финальная запись при остановке дождется текущей фоновой
+    async with _stats_lock:
+        if not _stats_pending:
+            return
+        pending, _stats_pending = _stats_pending, []
+        # Время активности обновляем раз за запись, а не на каждое сообщение
+        bot_stats["last_activity"] = datetime.now().isoformat()
+        try:
+            data = b"".join(orjson.dumps(entry) + b"\n" for entry in pending)
+            async with aiofiles.open(STATS_JOURNAL, "ab") as f:
+                await f.write(data)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения статистики: {str(e)}")
+
+async def compact_stats():
+    """Сворачивает журнал статистики в снимок и очищает журнал"""
+    global _stats_pending
+    async with _stats_lock:
+        if not _stats_pending and not os.path.exists(STATS_JOURNAL):
+            return
+        # Снимок содержит все события в памяти, в том числе еще не записанные в журнал
+        pending, _stats_pending = _stats_pending, []
+        # Время активности - по последнему событию, а не по моменту сжатия:
+        # иначе сжатие при запуске затерло бы время, восстановленное из журнала
+        if pending:
+            bot_stats["last_activity"] = datetime.fromtimestamp(pending[-1]["ts"]).isoformat()
+        # OPT_NON_STR_KEYS записывает int-ключи user_stats строками
+        data = orjson.dumps(bot_stats, option=orjson.OPT_NON_STR_KEYS)
+        try:
+            tmp_file = STATS_FILE.with_suffix(".tmp")
+            async with aiofiles.open(tmp_file, "wb") as f:
+                await f.write(data)
+            await aiofiles.os.replace(tmp_file, STATS_FILE)
+        except Exception as e:
+            # Снимок не записан: события остаются в очереди на запись в журнал
+            _stats_pending[:0] = pending
+            logger.error(f"Ошибка сжатия статистики: {str(e)}")
+            return
+        # Снимок уже содержит все события журнала (см. journal_seq),
+        # поэтому ошибка удаления журнала не приводит к повторному учету
+        try:
+            await aiofiles.os.remove(STATS_JOURNAL)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка удаления журнала статистики: {str(e)}")
+
+async def stats_flusher():
+    """Фоновая запись статистики: события за STATS_FLUSH_DELAY секунд сохраняются одной записью"""
+    while True:
+        await _stats_dirty.wait()
+        await asyncio.sleep(STATS_FLUSH_DELAY)
+        _stats_dirty.clear()
+        # shield: отмена задачи при остановке не должна обрывать начатую запись
+        await asyncio.shield(save_stats())
+
+def flush_stats_sync():
+    """Дописывает в журнал события, учтенные после финального сжатия статистики"""
+    # start_polling не ждет обработчики: их finally выполняется при отмене задач
+    # в asyncio.run, уже после on_shutdown, поэтому пишем синхронно при выходе
+    if not _stats_pending:
+        return
+    try:
+        with open(STATS_JOURNAL, "ab") as f:
+            f.write(b"".join(orjson.dumps(entry) + b"\n" for entry in _stats_pending))
+        _stats_pending.clear()
+    except Exception as e:
+        logger.error(f"Ошибка сохранения статистики при выходе: {str(e)}")
+
+load_stats()
+atexit.register(flush_stats_sync)
 
 def log_event(event: str, user_id: int = None, details: str = None):
     """Логирование событий с дополнительной информацией"""
+    # Не собираем строку, если INFO отключен
+    if not logger.isEnabledFor(logging.INFO):
+        return
     log_msg = f"[EVENT] {event}"
     if user_id:
         log_msg += f" | User: {user_id}"
@@ -106,24 +318,15 @@ def log_event(event: str, user_id: int = None, details: str = None):
         log_msg += f" | Details: {truncated}"
     logger.info(log_msg)
 
+@functools.lru_cache(maxsize=4096)  # Популярные ссылки присылают повторно
 def get_url_hash(url: str) -> str:
     """Генерирует хеш для URL"""
-    return hashlib.md5(url.encode()).hexdigest()
-
-def get_platform(url: str) -> str:
-    """Определяет платформу по URL"""
-    if "tiktok.com" in url:
-        return "tiktok"
-    elif "instagram.com" in url:
-        return "instagram"
-    elif "youtube.com/shorts" in url or "youtu.be" in url:
-        return "youtube"
-    return "other"
+    return hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
 
 async def async_remove_file(path: str):
     """Асинхронное удаление файла с обработкой ошибок"""
     try:
-        os.remove(path)
+        await asyncio.to_thread(os.remove, path)
         logger.info(f"Удален файл: {path}")
     except Exception as e:
         logger.error(f"Ошибка удаления файла {path}: {str(e)}")
@@ -135,15 +338,21 @@ def clean_old_files(directory: Path, days: int, file_pattern: str = "*"):
     :param days: Максимальный возраст файлов в днях
     :param file_pattern: Шаблон для поиска файлов
     """
-    now = datetime.now()
-    for file in directory.glob(file_pattern):
-        try:
-            file_age = now - datetime.fromtimestamp(file.stat().st_mtime)
-            if file_age > timedelta(days=days):
-                file.unlink()
-                logger.info(f"Удален старый файл: {file.name} (возраст: {file_age.days} дней)")
-        except Exception as e:
-            logger.error(f"Ошибка обработки файла {file.name}: {str(e)}")
+    now = time.time()
+    max_age = timedelta(days=days).total_seconds()
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not fnmatch.fnmatchcase(entry.name, file_pattern):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                file_age = now - entry.stat().st_mtime
+                if file_age > max_age:
+                    os.unlink(entry.path)
+                    logger.info(f"Удален старый файл: {entry.name} (возраст: {int(file_age // 86400)} дней)")
+            except Exception as e:
+                logger.error(f"Ошибка обработки файла {entry.name}: {str(e)}")
 
 def clean_old_logs():
     """Очищает старые логи"""
@@ -153,32 +362,76 @@ def clean_old_cache():
     """Очищает старый кеш видео"""
     clean_old_files(CACHE_DIR, CACHE_EXPIRE_DAYS)
 
-def clean_cache_by_size():
-    """Очищает кеш при превышении максимального размера"""
-    try:
-        files = sorted(CACHE_DIR.glob("*"), key=lambda f: f.stat().st_mtime)
-        total_size = sum(f.stat().st_size for f in files)
-        max_size_bytes = MAX_CACHE_SIZE_GB * 1024**3
-        
-        deleted_count = 0
-        while total_size > max_size_bytes and files:
-            oldest = files.pop(0)
-            file_size = oldest.stat().st_size
-            oldest.unlink()
-            total_size -= file_size
-            deleted_count += 1
-            logger.debug(f"Удален файл кеша: {oldest.name} ({file_size/1024**2:.2f} MB)")
-        
-        if deleted_count > 0:
-            logger.info(f"Очистка кеша: удалено {deleted_count} файлов, текущий размер: {total_size/1024**3:.2f}GB")
-    except Exception as e:
-        logger.error(f"Ошибка очистки кеша: {str(e)}")
+def scan_cache() -> dict[str, os.stat_result]:
+    """Возвращает stat() файлов кеша по именам"""
+    # Один stat() на файл: DirEntry кеширует результат
+    with os.scandir(CACHE_DIR) as it:
+        return {entry.name: entry.stat() for entry in it if entry.is_file()}
+
+async def load_cache_index():
+    """Синхронизирует LRU-индекс кеша с содержимым CACHE_DIR"""
+    global cache_size
+    # Блокировка: файл, добавленный или вытесненный во время сканирования,
+    # иначе пропал бы из индекса или вернулся в него
+    async with cache_lock:
+        try:
+            entries = await asyncio.to_thread(scan_cache)
+        except Exception as e:
+            logger.error(f"Ошибка сканирования кеша: {str(e)}")
+            return
+        # Порядок использования известных файлов сохраняем, удаленные убираем
+        for name in list(cache_index):
+            st = entries.pop(name, None)
+            if st is None:
+                del cache_index[name]
+                video_file_ids.pop(name, None)
+            else:
+                cache_index[name] = st.st_size
+        # Сортируем только новые файлы (все - лишь при первом запуске), от старых к новым
+        for name, st in sorted(entries.items(), key=lambda e: e[1].st_mtime):
+            cache_index[name] = st.st_size
+        cache_size = sum(cache_index.values())
+
+def cache_touch(name: str):
+    """Отмечает файл кеша как недавно использованный"""
+    if name in cache_index:
+        cache_index.move_to_end(name)
+
+async def cache_add(name: str, size: int):
+    """Добавляет файл в индекс кеша и очищает кеш при превышении лимита"""
+    global cache_size
+    async with cache_lock:
+        cache_size += size - cache_index.pop(name, 0)
+        cache_index[name] = size
+        await _trim_cache()
+
+async def clean_cache_by_size():
+    """Очищает кеш при превышении максимального размера, удаляя давно неиспользуемые файлы"""
+    async with cache_lock:
+        await _trim_cache()
+
+async def _trim_cache():
+    """Удаляет давно неиспользуемые файлы, пока кеш превышает лимит (вызывается под cache_lock)"""
+    global cache_size
+    max_size_bytes = MAX_CACHE_SIZE_GB * 1024**3
+    
+    deleted_count = 0
+    # Самый свежий файл не удаляем, даже если он один превышает лимит
+    while cache_size > max_size_bytes and len(cache_index) > 1:
+        name, file_size = cache_index.popitem(last=False)
+        cache_size -= file_size
+        video_file_ids.pop(name, None)
+        deleted_count += 1
+        logger.debug("Удален файл кеша: %s (%.2f MB)", name, file_size/1024**2)
+        await async_remove_file(str(CACHE_DIR / name))
+    
+    if deleted_count > 0:
+        logger.info(f"Очистка кеша: удалено {deleted_count} файлов, текущий размер: {cache_size/1024**3:.2f}GB")
 
 @dp.message(Command("start"))
 async def start(message: Message):
     """Обработчик команды /start"""
-    bot_stats["user_stats"][str(message.from_user.id)] += 1
-    save_stats()
+    record_stat("start", user=message.from_user.id)
     
     log_event("Command received", message.from_user.id, "/start")
     await message.answer(
@@ -204,16 +457,10 @@ async def show_stats(message: Message):
         f"• Звернень до кешу: {bot_stats['cache_hits']}\n"
         "📈 За платформами:\n"
     )
-    
-    platform_names = {
-        "tiktok": "TikTok",
-        "instagram": "Instagram", 
-        "youtube": "YouTube",
-        "other": "Інші"
-    }
-    
-    for platform, count in sorted(bot_stats["platform_stats"].items(), key=lambda x: x[1], reverse=True):
-        stats_msg += f"• {platform_names.get(platform, platform)}: {count}\n"
+    stats_msg += "".join(
+        f"• {PLATFORM_NAMES.get(platform, platform)}: {count}\n"
+        for platform, count in bot_stats["platform_stats"].most_common()
+    )
     
     await message.answer(stats_msg)
 
@@ -221,80 +468,70 @@ async def show_stats(message: Message):
 async def handle_links(message: Message):
     """Обработчик ссылок на видео"""
     text = message.text or message.caption
-    url = extract_url(text)
+    found = extract_url(text)
     user_id = message.from_user.id
     
-    if not url:
+    if not found:
         log_event("URL not found", user_id)
         await message.answer("🔴 Не знайдено посилання. Спробуй ще раз!")
         return
 
-    # Обновляем статистику
-    bot_stats["total_requests"] += 1
-    bot_stats["user_stats"][str(user_id)] += 1
-    platform = get_platform(url)
-    bot_stats["platform_stats"][platform] += 1
-    save_stats()
-    
-    log_event("Processing video", user_id, f"URL: {url[:50]}...")
+    url, platform = found
+    url_hash = get_url_hash(url)
+    req = VideoRequest(url, platform, url_hash, CACHE_DIR / f"{url_hash}.mp4")
+    log_event("Processing video", user_id, f"URL: {req.url[:50]}...")
 
     wait_msg = None
     file_path = None
+    result = "failure"
+    cache_hit = False
     
     try:
-        # Проверка кеша
-        url_hash = get_url_hash(url)
-        cached_file = CACHE_DIR / f"{url_hash}.mp4"
+        # Проверка кеша: один stat() дает и наличие файла, и его размер
+        try:
+            file_size = os.stat(req.cached_file).st_size
+        except FileNotFoundError:
+            file_size = None
         
-        if cached_file.exists():
-            bot_stats["cache_hits"] += 1
-            save_stats()
+        if file_size is not None:
+            cache_touch(req.cached_file.name)
+            cache_hit = True
             log_event("Cache used", user_id)
-            file_path = str(cached_file)
+            file_path = str(req.cached_file)
         else:
             log_event("Downloading video", user_id)
             wait_msg = await message.answer("⏳ Обробляю ваше відео...")
             
-            start_time = datetime.now()
-            file_path = await download_video(url, url_hash)
-            download_time = (datetime.now() - start_time).total_seconds()
+            start_ns = time.monotonic_ns()
+            file_path, file_size = await fetch_video(req)
+            download_time = (time.monotonic_ns() - start_ns) / 1e9
             
             log_event("Video downloaded", user_id, 
-                     f"Size: {os.path.getsize(file_path)/1024**2:.2f}MB, Time: {download_time:.2f}s")
+                     f"Size: {file_size/1024**2:.2f}MB, Time: {download_time:.2f}s")
 
-        file_size = os.path.getsize(file_path)
         if file_size > MAX_FILE_SIZE:
-            raise ValueError(f"File too large ({file_size/1024**2:.2f}MB)")
-
-        video = FSInputFile(file_path)
-        await message.answer_video(
-            video,
-            caption="Ось ваше відео без водяного знаку! ✅",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="📥 Скачати ще", callback_data="download_more")]
-            ])
-        )
+            raise FileTooLargeError(f"File too large ({file_size/1024**2:.2f}MB)")
+
+        await send_video(message, file_path)
 
-        bot_stats["successful_downloads"] += 1
-        save_stats()
+        result = "success"
         log_event("Video sent", user_id)
 
     except subprocess.TimeoutExpired as e:
-        bot_stats["failed_downloads"] += 1
-        save_stats()
         logger.error(f"Timeout: {str(e)}")
         await message.answer("🔴 Час завантаження вийшов. Спробуйте ще раз.")
+    except FileTooLargeError as e:
+        logger.error(f"Download rejected: {str(e)}")
+        await message.answer("🔴 Відео завелике: Telegram приймає файли до 50 МБ.")
     except subprocess.CalledProcessError as e:
-        bot_stats["failed_downloads"] += 1
-        save_stats()
         logger.error(f"Download failed: {str(e)}")
         await message.answer("🔴 Помилка завантаження відео. Перевірте посилання.")
     except Exception as e:
-        bot_stats["failed_downloads"] += 1
-        save_stats()
         logger.error(f"Unexpected error: {str(e)}", exc_info=True)
         await message.answer("🔴 Сталася неочікувана помилка. Спробуйте інше посилання.")
     finally:
+        # Вся статистика по запросу - одним событием
+        record_stat("request", user=user_id, platform=req.platform, result=result, cache_hit=cache_hit)
         if wait_msg:
             try:
                 await bot.delete_message(chat_id=message.chat.id, message_id=wait_msg.message_id)
@@ -303,42 +540,101 @@ async def handle_links(message: Message):
         if file_path and not file_path.startswith(str(CACHE_DIR)):
             await async_remove_file(file_path)
 
-def extract_url(text: str) -> str | None:
-    """Извлекает URL из текста"""
-    import re
-    url_pattern = (
-        r'https?://(?:vm\.tiktok\.com|'
-        r'www\.tiktok\.com|'
-        r'www\.instagram\.com/reel|'
-        r'youtu\.be|'
-        r'youtube\.com/shorts)\S+'
+async def send_video(message: Message, file_path: str):
+    """Отправляет видео, повторно используя file_id, если файл уже загружался в Telegram"""
+    name = os.path.basename(file_path)
+    caption = "Ось ваше відео без водяного знаку! ✅"
+    
+    file_id = video_file_ids.get(name)
+    if file_id:
+        try:
+            await message.answer_video(file_id, caption=caption, reply_markup=DOWNLOAD_MORE_KEYBOARD)
+            return
+        except TelegramBadRequest as e:
+            logger.warning(f"file_id rejected, uploading again: {str(e)}")
+            video_file_ids.pop(name, None)
+    
+    # FSInputFile читает файл блоками через aiofiles, не загружая его целиком в память
+    video = FSInputFile(file_path, chunk_size=UPLOAD_CHUNK_SIZE)
+    # Увеличенный таймаут только для загрузки файла, long polling его не получает
+    sent = await bot(
+        message.answer_video(video, caption=caption, reply_markup=DOWNLOAD_MORE_KEYBOARD),
+        request_timeout=TELEGRAM_TIMEOUT
     )
-    match = re.search(url_pattern, text)
-    return match.group(0) if match else None
+    if sent.video:
+        video_file_ids[name] = sent.video.file_id
 
-async def download_video(url: str, url_hash: str) -> str:
-    """Скачивает видео и сохраняет в кеш"""
-    clean_cache_by_size()  # Проверка размера перед скачиванием
-    
-    output_path = str(CACHE_DIR / f"{url_hash}.mp4")
+def extract_url(text: str) -> tuple[str, str] | None:
+    """Извлекает URL из текста и определяет платформу"""
+    if not any(hint in text for hint in URL_HINTS):
+        return None
+    match = URL_RE.search(text)
+    if not match:
+        return None
+    return match.group(0), match.lastgroup or "other"
+
+async def download_video(req: VideoRequest) -> tuple[str, int]:
+    """Скачивает видео в req.cached_file, возвращает путь и размер файла"""
+    output_path = str(req.cached_file)
     command = [
         "yt-dlp",
         "-f", "best[ext=mp4]",
         "-o", output_path,
+        # yt-dlp пропускает загрузку, если размер известен заранее и превышает лимит
+        "--max-filesize", str(MAX_FILE_SIZE),
         "--no-warnings",
         "--quiet",
-        url
+        req.url
     ]
     
-    logger.debug(f"Executing: {' '.join(command)}")
-    result = subprocess.run(command, check=True, timeout=120, capture_output=True, text=True)
+    logger.debug("Executing: %s", command)
+    proc = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=DOWNLOAD_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(command, DOWNLOAD_TIMEOUT) from None
+    finally:
+        # Не оставляем yt-dlp после таймаута или отмены задачи (например, при остановке бота)
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
     
-    if result.stderr:
-        logger.debug(f"yt-dlp stderr: {result.stderr}")
-    if result.stdout:
-        logger.debug(f"yt-dlp stdout: {result.stdout}")
+    if logger.isEnabledFor(logging.DEBUG):
+        if stderr:
+            logger.debug("yt-dlp stderr: %s", stderr.decode(errors='replace'))
+        if stdout:
+            logger.debug("yt-dlp stdout: %s", stdout.decode(errors='replace'))
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command, stdout, stderr)
+    try:
+        file_size = os.stat(output_path).st_size
+    except FileNotFoundError:
+        # Успешный выход без файла: загрузка пропущена из-за --max-filesize
+        raise FileTooLargeError(f"File exceeds {MAX_FILE_SIZE/1024**2:.0f}MB limit") from None
     
-    return output_path
+    await cache_add(req.cached_file.name, file_size)
+    return output_path, file_size
+
+async def _download_limited(req: VideoRequest) -> tuple[str, int]:
+    """Скачивает видео с учетом лимита одновременных загрузок"""
+    async with DOWNLOAD_SEM:
+        return await download_video(req)
+
+async def fetch_video(req: VideoRequest) -> tuple[str, int]:
+    """Скачивает видео, объединяя одновременные запросы одного и того же URL"""
+    future = INFLIGHT.get(req.url_hash)
+    if future is None:
+        future = asyncio.create_task(_download_limited(req))
+        INFLIGHT[req.url_hash] = future
+        future.add_done_callback(lambda _: INFLIGHT.pop(req.url_hash, None))
+    else:
+        log_event("Download joined", details=req.url_hash)
+    # shield: отмена одного обработчика не должна прерывать загрузку для остальных
+    return await asyncio.shield(future)
 
 @dp.callback_query(F.data == "download_more")
 async def download_more(callback: CallbackQuery):
@@ -347,22 +643,55 @@ async def download_more(callback: CallbackQuery):
     await callback.answer()
     await callback.message.answer("Надішліть нове посилання на відео:")
 
+async def janitor():
+    """Фоновая задача: периодически очищает старые логи и кеш, сворачивает журнал статистики"""
+    while True:
+        logger.debug("Cleaning old files...")
+        try:
+            await asyncio.gather(
+                asyncio.to_thread(clean_old_logs),
+                asyncio.to_thread(clean_old_cache)
+            )
+            # Индекс и лимит размера проверяем после удаления устаревших файлов
+            await load_cache_index()
+            await clean_cache_by_size()
+            await asyncio.shield(compact_stats())
+        except Exception as e:
+            logger.error(f"Ошибка фоновой очистки: {str(e)}", exc_info=True)
+        await asyncio.sleep(JANITOR_INTERVAL)
+
 async def on_startup():
     """Действия при запуске бота"""
-    logger.info("Cleaning old files...")
-    clean_old_logs()
-    clean_old_cache()
-    clean_cache_by_size()
+    background_tasks.add(asyncio.create_task(janitor()))
+    background_tasks.add(asyncio.create_task(stats_flusher()))
+    # Прогреваем DNS и соединение с Telegram до первого сообщения;
+    # bot.me() кеширует ответ, start_polling использует его повторно
+    me = await bot.me()
+    logger.info(f"Authorized as @{me.username}")
     logger.info("Bot starting...")
 
+async def on_shutdown():
+    """Действия при остановке бота"""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await compact_stats()
+    logger.info("Bot stopped")
+
 async def main():
     """Основная функция запуска бота"""
     await on_startup()
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await on_shutdown()
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if uvloop is not None:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except Exception as e:
         logger.critical(f"Bot crashed: {str(e)}", exc_info=True)
         raise
\ No newline at end of file